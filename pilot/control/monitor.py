@@ -12,7 +12,6 @@
 #       a task for the job_monitor thread in the Job component.
 
 import logging
-import threading
 import time
 import re
 from os import environ, getpid, getuid
@@ -43,11 +42,12 @@ def control(queues, traces, args):  # noqa: C901
     :return:
     """
 
-    t_0 = time.time()
+    t_0 = time.monotonic()
     traces.pilot['lifetime_start'] = t_0  # ie referring to when pilot monitoring began
     traces.pilot['lifetime_max'] = t_0
 
     threadchecktime = int(config.Pilot.thread_check)
+    next_thread_check = t_0 + threadchecktime
 
     # for CPU usage debugging
     cpuchecktime = int(config.Pilot.cpu_check)
@@ -63,7 +63,7 @@ def control(queues, traces, args):  # noqa: C901
         max_running_time_old = 0
         while not args.graceful_stop.is_set():
             # every few seconds, run the monitoring checks
-            if args.graceful_stop.wait(1) or args.graceful_stop.is_set():
+            if args.graceful_stop.wait(2) or args.graceful_stop.is_set():
                 logger.warning('aborting monitor loop since graceful_stop has been set (timing out remaining threads)')
                 run_checks(queues, args)
                 break
@@ -102,39 +102,33 @@ def control(queues, traces, args):  # noqa: C901
 
             # every minute run the following check
             if is_pilot_check(check='machinefeatures'):
-                if time.time() - last_minute_check > 60:
+                if time.monotonic() - last_minute_check > 60:
                     reached_maxtime = run_shutdowntime_minute_check(time_since_start)
                     if reached_maxtime:
                         reached_maxtime_abort(args)
                         break
-                    last_minute_check = time.time()
-
-            # take a nap
-            time.sleep(1)
+                    last_minute_check = time.monotonic()
 
             # time to check the CPU usage?
             if is_pilot_check(check='cpu_usage'):
-                if int(time.time() - tcpu) > cpuchecktime and False:  # for testing only
+                if int(time.monotonic() - tcpu) > cpuchecktime and False:  # for testing only
                     processes = get_process_info('python3 pilot3/pilot.py', pid=getpid())
                     if processes:
                         logger.info(f'PID={getpid()} has CPU usage={processes[0]}% CMD={processes[2]}')
                         nproc = processes[3]
                         if nproc > 1:
                             logger.info(f'.. there are {nproc} such processes running')
-                    tcpu = time.time()
+                    tcpu = time.monotonic()
 
             # proceed with running the other checks
             run_checks(queues, args)
 
             # thread monitoring
             if is_pilot_check(check='threads'):
-                if int(time.time() - traces.pilot['lifetime_start']) % threadchecktime == 0:
-                    # get all threads
-                    for thread in threading.enumerate():
-                        # logger.info('thread name: %s', thread.name)
-                        if not thread.is_alive():
-                            logger.fatal(f'thread \'{thread.name}\' is not alive')
-                            # args.graceful_stop.set()
+                now = time.monotonic()
+                if now >= next_thread_check:
+                    check_worker_threads(traces)
+                    next_thread_check = now + threadchecktime
 
             niter += 1
 
@@ -145,6 +139,25 @@ def control(queues, traces, args):  # noqa: C901
     logger.info('[monitor] control thread has ended')
 
 
+def check_worker_threads(traces):
+    """
+    Verify that the worker threads registered by the workflow are still alive.
+
+    Note: threading.enumerate() only returns alive threads, so the registered thread objects are checked instead.
+    A dead thread is only reported once since it is removed from the registry.
+
+    :param traces: traces object.
+    :return:
+    """
+
+    workers = traces.pilot.get('workers', {})
+    for name, thread in list(workers.items()):
+        if not thread.is_alive():
+            logger.fatal(f'thread \'{name}\' is not alive')
+            del workers[name]
+            # args.graceful_stop.set()
+
+
 def run_shutdowntime_minute_check(time_since_start):
     """
     Run checks on machine features shutdowntime once a minute.
@@ -222,7 +235,7 @@ def reached_maxtime_abort(args):
 
 
 #def log_lifetime(sig, frame, traces):
-#    logger.info('lifetime: %i used, %i maximum', int(time.time() - traces.pilot['lifetime_start']), traces.pilot['lifetime_max'])
+#    logger.info('lifetime: %i used, %i maximum', int(time.monotonic() - traces.pilot['lifetime_start']), traces.pilot['lifetime_max'])
 
 
 def get_process_info(cmd, user=None, args='aufx', pid=None):
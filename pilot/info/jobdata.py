@@ -88,6 +88,7 @@ class JobData(BaseData):
     serverstate = ""               # server job states; starting, running, finished, holding, failed
     stageout = ""                  # stage-out identifier, e.g. log
     metadata = {}                  # payload metadata (job report)
+    work_attributes = None         # parsed payload metadata, see user specific get_work_attributes() (ATLAS)
     cpuconsumptionunit = "s"       #
     cpuconsumptiontime = -1        #
     cpuconversionfactor = 1        #
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2023
+
+import unittest
+
+from pilot.info import infosys
+from pilot.info.queuedata import QueueData
+from pilot.user.atlas.container import extract_platform_and_os, get_middleware_type, remove_container_string
+
+
+class TestContainer(unittest.TestCase):
+    """
+    Unit tests for the ATLAS container functions.
+    """
+
+    def test_extract_platform_and_os(self):
+        """
+        Make sure that the architecture and OS substring is extracted from the platform.
+
+        :return: (assertion)
+        """
+
+        self.assertEqual(extract_platform_and_os('x86_64-slc6-gcc48-opt'), 'x86_64-slc6')
+        self.assertEqual(extract_platform_and_os('x86_64-centos7-gcc8-opt'), 'x86_64-centos7')
+
+        # the pattern is anchored at the beginning of the string; the full platform is returned on failure
+        self.assertEqual(extract_platform_and_os('centos7'), 'centos7')
+        self.assertEqual(extract_platform_and_os('+x86_64-slc6-gcc48-opt'), '+x86_64-slc6-gcc48-opt')
+
+    def test_remove_container_string(self):
+        """
+        Make sure that the --containerImage option is extracted and removed from the job parameters.
+
+        :return: (assertion)
+        """
+
+        job_params, container_path = remove_container_string('--a=1 --containerImage=docker://atlas/athena:21 --b=2')
+        self.assertEqual(container_path, 'docker://atlas/athena:21')
+        self.assertNotIn('--containerImage', job_params)
+
+        job_params, container_path = remove_container_string('--a=1 --b=2')
+        self.assertEqual(container_path, '')
+        self.assertEqual(job_params, '--a=1 --b=2')
+
+    def test_get_middleware_type(self):
+        """
+        Make sure that the middleware type is read from the parsed container_type.
+
+        :return: (assertion)
+        """
+
+        queuedata = infosys.queuedata
+        try:
+            infosys.queuedata = QueueData({'container_type': 'singularity:pilot;docker:wrapper;container:middleware'})
+            self.assertEqual(get_middleware_type(), 'container')
+
+            infosys.queuedata = QueueData({'container_type': 'singularity:pilot'})
+            self.assertEqual(get_middleware_type(), 'workernode')
+        finally:
+            infosys.queuedata = queuedata
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2023
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pilot.user.atlas import diagnose
+from pilot.user.atlas.diagnose import get_matching_lines, scan_for_patterns
+
+
+class TestDiagnose(unittest.TestCase):
+    """
+    Unit tests for the ATLAS payload log scanning functions.
+    """
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write_file(self, name, data):
+        """
+        Create a file with the given content in the temporary directory.
+
+        :param name: file name (string).
+        :param data: file content (bytes).
+        :return: full path to file (string).
+        """
+
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, 'wb') as _file:
+            _file.write(data)
+
+        return path
+
+    def test_get_matching_lines(self):
+        """
+        Make sure that each matching line is reported once, in file order.
+
+        :return: (assertion)
+        """
+
+        patterns = ["St9bad_alloc", "std::bad_alloc"]
+        data = b'first\nboth std::bad_alloc and St9bad_alloc\nnone\nonly St9bad_alloc\n'
+        self.assertEqual(get_matching_lines(data, patterns),
+                         ['both std::bad_alloc and St9bad_alloc', 'only St9bad_alloc'])
+
+        # the same pattern repeated on one line
+        self.assertEqual(get_matching_lines(b'a std::bad_alloc std::bad_alloc\n', patterns),
+                         ['a std::bad_alloc std::bad_alloc'])
+
+        # match on the last line without a trailing newline
+        self.assertEqual(get_matching_lines(b'first\nlast std::bad_alloc', patterns), ['last std::bad_alloc'])
+
+        self.assertEqual(get_matching_lines(b'', patterns), [])
+        self.assertEqual(get_matching_lines(b'nothing to see\n', patterns), [])
+
+    def test_scan_for_patterns(self):
+        """
+        Make sure that scan_for_patterns() handles normal, empty and missing files.
+
+        :return: (assertion)
+        """
+
+        patterns = ["prepare 5 database is locked", "Error SQLiteStatement"]
+        path = self.write_file('payload.stdout', b'ok\nError SQLiteStatement: prepare 5 database is locked\nok')
+        self.assertEqual(scan_for_patterns(path, patterns), ['Error SQLiteStatement: prepare 5 database is locked'])
+
+        path = self.write_file('empty.stdout', b'')
+        self.assertEqual(scan_for_patterns(path, patterns), [])
+
+        self.assertEqual(scan_for_patterns(os.path.join(self.tmp_dir, 'missing.stdout'), patterns), [])
+
+    def test_scan_for_patterns_tail(self):
+        """
+        Make sure that only the tail of a file larger than FULL_SCAN_LIMIT is scanned.
+
+        :return: (assertion)
+        """
+
+        data = b'early std::bad_alloc\n' + b'x' * 100 + b'\nlate std::bad_alloc\n'
+        path = self.write_file('payload.stdout', data)
+        with mock.patch.object(diagnose, 'FULL_SCAN_LIMIT', 64), mock.patch.object(diagnose, 'TAIL_SCAN_SIZE', 32):
+            self.assertEqual(scan_for_patterns(path, ["std::bad_alloc"]), ['late std::bad_alloc'])
+
+        self.assertEqual(scan_for_patterns(path, ["std::bad_alloc"]), ['early std::bad_alloc', 'late std::bad_alloc'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Authors:
+# - Paul Nilsson, paul.nilsson@cern.ch, 2023
+
+import os
+import tempfile
+import unittest
+
+from pilot.util.filehandling import read_tail_bytes
+
+
+class TestFileHandling(unittest.TestCase):
+    """
+    Unit tests for the file handling functions.
+    """
+
+    def test_read_tail_bytes(self):
+        """
+        Make sure that read_tail_bytes() returns the last bytes of a file, or the whole content of a shorter file.
+
+        :return: (assertion)
+        """
+
+        tmp_fd, tmp_file = tempfile.mkstemp()
+        os.close(tmp_fd)
+        try:
+            with open(tmp_file, 'wb') as _file:
+                _file.write(b'0123456789')
+
+            self.assertEqual(read_tail_bytes(tmp_file, 4), b'6789')
+            self.assertEqual(read_tail_bytes(tmp_file, 10), b'0123456789')
+            self.assertEqual(read_tail_bytes(tmp_file, 100), b'0123456789')
+
+            with open(tmp_file, 'wb') as _file:
+                pass
+            self.assertEqual(read_tail_bytes(tmp_file, 4), b'')
+        finally:
+            os.remove(tmp_file)
+
+        self.assertRaises(OSError, read_tail_bytes, tmp_file, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1037,7 +1037,7 @@ def update_job_data(job):
 
     work_attributes = None
     try:
-        work_attributes = parse_jobreport_data(job.metadata)
+        work_attributes = get_work_attributes(job)
     except Exception as exc:
         logger.warning('failed to parse job report (cannot set job.nevents): %s', exc)
     else:
@@ -1692,6 +1692,22 @@ def parse_jobreport_data(job_report):  # noqa: C901
     return work_attributes
 
 
+def get_work_attributes(job):
+    """
+    Return the parsed job report data for the given job.
+    parse_jobreport_data() is expensive (e.g. it calculates the disk usage of the work directory), so the result is
+    stored in the job object. The stored value must be reset (job.work_attributes = None) when job.metadata is updated.
+
+    :param job: job object.
+    :return: work attributes (dictionary).
+    """
+
+    if job.work_attributes is None:
+        job.work_attributes = parse_jobreport_data(job.metadata)
+
+    return job.work_attributes
+
+
 def get_executor_dictionary(jobreport_dictionary):
     """
     Extract the 'executor' dictionary from with a job report.
@@ -9,9 +9,9 @@
 # - Alexander Bogdanchikov, Alexander.Bogdanchikov@cern.ch, 2019-2020
 
 import os
-import pipes
 import re
 import logging
+import shlex
 
 # for user container test: import urllib
 
@@ -26,6 +26,13 @@ from pilot.util.filehandling import write_file
 logger = logging.getLogger(__name__)
 errors = ErrorCodes()
 
+_PLATFORM_RE = re.compile(r"([A-Za-z0-9_-]+)-.+-.+")
+_CONTAINER_QUOTE_RE = re.compile(r"\'\ \'")
+_CONTAINER_IMAGE_RE = re.compile(r" \'?\-\-containerImage\=?\ ?([\S]+)\ ?\'?")
+_ASETUP_CACHE = {}  # ALRB based get_asetup() results, keyed by arguments and file system root path
+_GRID_IMAGE_CACHE = {}  # get_grid_image() results, keyed by platform and file system root path
+_PILOT_HOME = ''  # PILOT_HOME is set once by pilot.py before any command is wrapped
+
 
 def do_use_container(**kwargs):
     """
@@ -77,7 +84,7 @@ def wrapper(executable, **kwargs):
     """
 
     workdir = kwargs.get('workdir', '.')
-    pilot_home = os.environ.get('PILOT_HOME', '')
+    pilot_home = get_pilot_home()
     job = kwargs.get('job', None)
 
     if workdir == '.' and pilot_home != '':
@@ -91,6 +98,45 @@ def wrapper(executable, **kwargs):
     return fctn(executable, workdir, job=job)
 
 
+def get_pilot_home():
+    """
+    Return the pilot home directory.
+    The value is read from the environment until it has been set, after which the stored value is returned.
+
+    :return: PILOT_HOME (string).
+    """
+
+    global _PILOT_HOME
+    if not _PILOT_HOME:
+        _PILOT_HOME = os.environ.get('PILOT_HOME', '')
+
+    return _PILOT_HOME
+
+
+def get_cached_asetup(asetup=True, alrb=False, add_if=False):
+    """
+    Return the output from get_asetup(), cached per argument combination.
+    Only the ALRB based setup is cached, since it only depends on paths on the (cvmfs) file system, so there is no need
+    to check them for every job. A change of the file system root path (ATLAS_SW_BASE) will lead to a new lookup.
+    The fallback setup based on appdir/VO_ATLAS_SW_DIR can change with the queue and is therefore never cached.
+
+    :param asetup: Boolean. True value means that the pilot should include the asetup command.
+    :param alrb: Boolean. True value means that the function should return special setup used with ALRB and containers.
+    :param add_if: Boolean. True means that an if statement will be placed around the export.
+    :raises: NoSoftwareDir if appdir does not exist.
+    :return: source <path>/asetup.sh (string).
+    """
+
+    key = (asetup, alrb, add_if, get_file_system_root_path())
+    cmd = _ASETUP_CACHE.get(key)
+    if not cmd:
+        cmd = get_asetup(asetup=asetup, alrb=alrb, add_if=add_if)
+        if 'ATLAS_LOCAL_ROOT_BASE=' in cmd:
+            _ASETUP_CACHE[key] = cmd
+
+    return cmd
+
+
 def extract_platform_and_os(platform):
     """
     Extract the platform and OS substring from platform
@@ -99,17 +145,14 @@ def extract_platform_and_os(platform):
     :return: extracted platform specifics (string). E.g. "x86_64-slc6". In case of failure, return the full platform
     """
 
-    pattern = r"([A-Za-z0-9_-]+)-.+-.+"
-    found = re.findall(re.compile(pattern), platform)
+    found = _PLATFORM_RE.match(platform)
+    if found is not None:
+        return found.group(1)
 
-    if found:
-        ret = found[0]
-    else:
-        logger.warning("could not extract architecture and OS substring using pattern=%s from platform=%s"
-                       "(will use %s for image name)", pattern, platform, platform)
-        ret = platform
+    logger.warning("could not extract architecture and OS substring using pattern=%s from platform=%s"
+                   "(will use %s for image name)", _PLATFORM_RE.pattern, platform, platform)
 
-    return ret
+    return platform
 
 
 def get_grid_image(platform):
@@ -124,10 +167,16 @@ def get_grid_image(platform):
         platform = "x86_64-slc6"
         logger.warning("using default platform=%s (cmtconfig not set)", platform)
 
+    # the image inventory does not change during the lifetime of the pilot, so only look it up once per platform
+    root_path = get_file_system_root_path()
+    path = _GRID_IMAGE_CACHE.get((platform, root_path))
+    if path:
+        return path
+
     arch_and_os = extract_platform_and_os(platform)
     image = arch_and_os + ".img"
-    _path1 = os.path.join(get_file_system_root_path(), "atlas.cern.ch/repo/containers/images/apptainer")
-    _path2 = os.path.join(get_file_system_root_path(), "atlas.cern.ch/repo/containers/images/singularity")
+    _path1 = os.path.join(root_path, "atlas.cern.ch/repo/containers/images/apptainer")
+    _path2 = os.path.join(root_path, "atlas.cern.ch/repo/containers/images/singularity")
     paths = [path for path in [_path1, _path2] if os.path.isdir(path)]
     _path = paths[0]
     path = os.path.join(_path, image)
@@ -139,6 +188,9 @@ def get_grid_image(platform):
             logger.warning('path does not exist either: %s', path)
             path = ""
 
+    if path:
+        _GRID_IMAGE_CACHE[(platform, root_path)] = path
+
     return path
 
 
@@ -152,25 +204,12 @@ def get_middleware_type():
     :return: middleware_type (string)
     """
 
-    middleware_type = ""
-    container_type = infosys.queuedata.container_type
-
-    middleware = 'middleware'
-    if container_type and container_type != "" and middleware in container_type:
-        try:
-            container_names = container_type.split(';')
-            for name in container_names:
-                _split = name.split(':')
-                if middleware == _split[0]:
-                    middleware_type = _split[1]
-        except IndexError as exc:
-            logger.warning("failed to parse the container name: %s, %s", container_type, exc)
-    else:
-        # logger.warning("container middleware type not specified in queuedata")
-        # no middleware type was specified, assume that middleware is present on worker node
-        middleware_type = "workernode"
+    # container_type has already been parsed by QueueData into a dict of container names by user,
+    # e.g. {'pilot': 'singularity', 'wrapper': 'docker', 'middleware': 'container'}
+    container_type = infosys.queuedata.container_type or {}
 
-    return middleware_type
+    # no middleware type was specified, assume that middleware is present on worker node
+    return container_type.get('middleware') or "workernode"
 
 
 def extract_atlas_setup(asetup, swrelease):
@@ -382,8 +421,10 @@ def alrb_wrapper(cmd, workdir, job=None):
     queuedata = job.infosys.queuedata
     container_name = queuedata.container_type.get("pilot")  # resolve container name for user=pilot
     if container_name:
+        is_cvmfs = queuedata.is_cvmfs
+
         # first get the full setup, which should be removed from cmd (or ALRB setup won't work)
-        _asetup = get_asetup()
+        _asetup = get_cached_asetup()
         _asetup = fix_asetup(_asetup)
         # get_asetup()
         # -> export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase;source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh
@@ -391,7 +432,8 @@ def alrb_wrapper(cmd, workdir, job=None):
         # atlas_setup = $AtlasSetup/scripts/asetup.sh
         # clean_asetup = export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase;source
         #                   ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh --quiet;
-        atlas_setup, clean_asetup = extract_atlas_setup(_asetup, job.swrelease)
+        swrelease = job.swrelease
+        atlas_setup, clean_asetup = extract_atlas_setup(_asetup, swrelease)
         full_atlas_setup = get_full_asetup(cmd, 'source ' + atlas_setup) if atlas_setup and clean_asetup else ''
 
         # do not include 'clean_asetup' in the container script
@@ -405,7 +447,7 @@ def alrb_wrapper(cmd, workdir, job=None):
         # -> export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase;source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh --quiet;
 
         # get simplified ALRB setup (export)
-        alrb_setup = get_asetup(alrb=True, add_if=True)
+        alrb_setup = get_cached_asetup(alrb=True, add_if=True)
         alrb_setup = fix_asetup(alrb_setup)
 
         # get_asetup(alrb=True)
@@ -414,7 +456,7 @@ def alrb_wrapper(cmd, workdir, job=None):
         # -> if [ -z "$ATLAS_LOCAL_ROOT_BASE" ]; then export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase; fi;
 
         # add user proxy if necessary (actually it should also be removed from cmd)
-        exit_code, diagnostics, alrb_setup, cmd = update_for_user_proxy(alrb_setup, cmd, is_analysis=job.is_analysis(), queue_type=job.infosys.queuedata.type)
+        exit_code, diagnostics, alrb_setup, cmd = update_for_user_proxy(alrb_setup, cmd, is_analysis=job.is_analysis(), queue_type=queuedata.type)
         if exit_code:
             job.piloterrordiag = diagnostics
             job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(exit_code)
@@ -431,8 +473,8 @@ def alrb_wrapper(cmd, workdir, job=None):
         cmd = cmd.replace(';;', ';')
 
         # get the proper release setup script name, and create the script if necessary
-        release_setup, cmd = create_release_setup(cmd, atlas_setup, full_atlas_setup, job.swrelease,
-                                                  job.workdir, queuedata.is_cvmfs)
+        release_setup, cmd = create_release_setup(cmd, atlas_setup, full_atlas_setup, swrelease,
+                                                  job.workdir, is_cvmfs)
 
         # correct full payload command in case preprocess command are used (ie replace trf with setupATLAS -c ..)
         if job.preprocess and job.containeroptions:
@@ -441,10 +483,11 @@ def alrb_wrapper(cmd, workdir, job=None):
 
         # write the full payload command to a script file
         container_script = config.Container.container_script
+        container_script_path = os.path.join(job.workdir, container_script)
         logger.debug('command to be written to container script file:\n\n%s:\n\n%s\n', container_script, cmd)
         try:
-            write_file(os.path.join(job.workdir, container_script), cmd, mute=False)
-            os.chmod(os.path.join(job.workdir, container_script), 0o755)  # Python 2/3
+            write_file(container_script_path, cmd, mute=False)
+            os.chmod(container_script_path, 0o755)  # Python 2/3
         # except (FileHandlingFailure, FileNotFoundError) as exc:  # Python 3
         except (FileHandlingFailure, OSError) as exc:  # Python 2/3
             logger.warning('exception caught: %s', exc)
@@ -454,7 +497,7 @@ def alrb_wrapper(cmd, workdir, job=None):
         job.command = cmd
 
         # add atlasLocalSetup command + options (overwrite the old cmd since the new cmd is the containerised version)
-        cmd = add_asetup(job, alrb_setup, queuedata.is_cvmfs, release_setup, container_script, queuedata.container_options)
+        cmd = add_asetup(job, alrb_setup, is_cvmfs, release_setup, container_script, queuedata.container_options)
 
         # add any container options if set
         execargs = job.containeroptions.get('execArgs', None)
@@ -480,36 +523,39 @@ def add_asetup(job, alrb_setup, is_cvmfs, release_setup, container_script, conta
     :return: final payload command (string).
     """
 
+    # the atlasLocalSetup command is assembled from parts that are joined once at the end
+    alrb_setup = alrb_setup.replace(';;', ';')
+    parts = []
+
     # this should not be necessary after the extract_container_image() in JobData update
     # containerImage should have been removed already
     if '--containerImage' in job.jobparams:
         job.jobparams, container_path = remove_container_string(job.jobparams)
         if job.alrbuserplatform:
             if not is_cvmfs:
-                alrb_setup += 'source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh -c %s' % job.alrbuserplatform
+                parts += ['source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh', '-c', job.alrbuserplatform]
         elif container_path != "":
-            alrb_setup += 'source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh -c %s' % container_path
+            parts += ['source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh', '-c', container_path]
         else:
             logger.warning('failed to extract container path from %s', job.jobparams)
             alrb_setup = ""
-        if alrb_setup and not is_cvmfs:
-            alrb_setup += ' -d'
+        if (alrb_setup or parts) and not is_cvmfs:
+            parts.append('-d')
     else:
-        alrb_setup += 'source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh '
+        parts.append('source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh')
         if job.platform or job.alrbuserplatform or job.imagename:
-            alrb_setup += '-c $thePlatform'
+            parts += ['-c', '$thePlatform']
             if not is_cvmfs:
-                alrb_setup += ' -d'
+                parts.append('-d')
 
     # update the ALRB setup command
-    alrb_setup += ' -s %s' % release_setup
-    alrb_setup += ' -r /srv/' + container_script
-    alrb_setup = alrb_setup.replace('  ', ' ').replace(';;', ';')
+    parts += ['-s', release_setup, '-r', '/srv/' + container_script]
 
     # add container options
-    alrb_setup += ' ' + get_container_options(container_options)
-    alrb_setup = alrb_setup.replace('  ', ' ')
-    cmd = alrb_setup
+    options = get_container_options(container_options)
+    if options:
+        parts.append(options)
+    cmd = alrb_setup + ' '.join(parts)
 
     # correct full payload command in case preprocess command are used (ie replace trf with setupATLAS -c ..)
     #if job.preprocess and job.containeroptions:
@@ -605,18 +651,18 @@ def create_release_setup(cmd, atlas_setup, full_atlas_setup, release, workdir, i
 def remove_container_string(job_params):
     """ Retrieve the container string from the job parameters """
 
-    pattern = r" \'?\-\-containerImage\=?\ ?([\S]+)\ ?\'?"
-    compiled_pattern = re.compile(pattern)
-
     # remove any present ' around the option as well
-    job_params = re.sub(r'\'\ \'', ' ', job_params)
+    job_params = _CONTAINER_QUOTE_RE.sub(' ', job_params)
 
-    # extract the container path
-    found = re.findall(compiled_pattern, job_params)
-    container_path = found[0] if found else ""
+    # extract the container path and remove the pattern from the job parameters in a single pass
+    found = []
 
-    # Remove the pattern and update the job parameters
-    job_params = re.sub(pattern, ' ', job_params)
+    def _replace(match):
+        found.append(match.group(1))
+        return ' '
+
+    job_params = _CONTAINER_IMAGE_RE.sub(_replace, job_params)
+    container_path = found[0] if found else ""
 
     return job_params, container_path
 
@@ -651,11 +697,7 @@ def container_wrapper(cmd, workdir, job=None):
         logger.info("singularity/apptainer has been requested")
 
         # Get the container options
-        options = queuedata.container_options
-        if options != "":
-            options += ","
-        else:
-            options = "-B "
+        options = f"{queuedata.container_options}," if queuedata.container_options else "-B "
         options += "/cvmfs,${workdir},/home"
         logger.debug("using options: %s", options)
 
@@ -668,7 +710,7 @@ def container_wrapper(cmd, workdir, job=None):
         # Does the image exist?
         if image_path:
             # Prepend it to the given command
-            quote = pipes.quote(f'cd $workdir;pwd;{cmd}')
+            quote = shlex.quote(f'cd $workdir;pwd;{cmd}')
             cmd = f"export workdir={workdir}; {container_name} --verbose exec {options} {image_path} " \
                   f"/bin/bash -c {quote}"
             #cmd = "export workdir=" + workdir + "; singularity --verbose exec " + options + " " + image_path + \
@@ -709,7 +751,7 @@ def create_root_container_command(workdir, cmd):
             if x509:
                 command += 'export X509_USER_PROXY=%s;' % x509
             command += 'export ALRB_CONT_RUNPAYLOAD=\"source /srv/%s\";' % script_name
-            _asetup = get_asetup(alrb=True)  # export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase;
+            _asetup = get_cached_asetup(alrb=True)  # export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase;
             _asetup = fix_asetup(_asetup)
             command += _asetup
             command += 'source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh -c CentOS7'
@@ -792,7 +834,7 @@ def create_middleware_container_command(job, cmd, label='stagein', proxy=True):
                 command += 'export ALRB_CONT_RUNPAYLOAD=\"source /srv/%s\";' % script_name
                 if 'ALRB_CONT_UNPACKEDDIR' in os.environ:
                     command += 'export ALRB_CONT_UNPACKEDDIR=%s;' % os.environ.get('ALRB_CONT_UNPACKEDDIR')
-            command += fix_asetup(get_asetup(alrb=True))  # export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase;
+            command += fix_asetup(get_cached_asetup(alrb=True))  # export ATLAS_LOCAL_ROOT_BASE=/cvmfs/atlas.cern.ch/repo/ATLASLocalRootBase;
             if label == 'setup':
                 # set the platform info
                 command += 'export thePlatform=\"%s\";' % job.platform
@@ -847,7 +889,7 @@ def get_middleware_container_script(middleware_container, cmd, asetup=False, lab
     else:
         content = 'export ALRB_LOCAL_PY3=YES; '
         if asetup:  # export ATLAS_LOCAL_ROOT_BASE=/cvmfs/..;source ${ATLAS_LOCAL_ROOT_BASE}/user/atlasLocalSetup.sh --quiet;
-            _asetup = get_asetup(asetup=False)
+            _asetup = get_cached_asetup(asetup=False)
             _asetup = fix_asetup(_asetup)
             content += _asetup
         if label == 'stagein' or label == 'stageout':
@@ -8,24 +8,31 @@
 # - Paul Nilsson, paul.nilsson@cern.ch, 2018-2022
 
 import json
+import mmap
 import os
 import re
 import logging
-from glob import glob
 
 from pilot.common.errorcodes import ErrorCodes
 from pilot.common.exception import PilotException, BadXML
 from pilot.util.config import config
-from pilot.util.filehandling import get_guid, tail, grep, open_file, read_file, scan_file  #, write_file
+from pilot.util.filehandling import get_guid, tail, read_file, read_tail_bytes, scan_file  #, write_file
 from pilot.util.math import convert_mb_to_b
 from pilot.util.workernode import get_local_disk_space
 
-from .common import update_job_data, parse_jobreport_data
+from .common import update_job_data, get_work_attributes
 from .metadata import get_metadata_from_xml, get_total_number_of_events, get_guid_from_xml
 
 logger = logging.getLogger(__name__)
 errors = ErrorCodes()
 
+_SUMMARY_EVENTS_RE = re.compile(rb'^Events (Read|Written)\: *(\d+)', re.MULTILINE)
+_TARBALL_URL_RE = re.compile(r"(https?\:\/\/.+)")
+
+# payload logs larger than this are only scanned in their tail, where out-of-memory and similar errors end up
+FULL_SCAN_LIMIT = 64 * 1024 * 1024  # B
+TAIL_SCAN_SIZE = 256 * 1024  # B
+
 
 def interpret(job):
     """
@@ -36,6 +43,7 @@ def interpret(job):
     """
 
     exit_code = 0
+    stdout, stderr = get_payload_log_paths(job)
 
     # extract errors from job report
     process_job_report(job)
@@ -53,7 +61,7 @@ def interpret(job):
     # check for special errors
     if exit_code == 146:
         logger.warning('user tarball was not downloaded (payload exit code %d)', exit_code)
-        set_error_nousertarball(job)
+        set_error_nousertarball(job, stdout)
     elif exit_code == 160:
         logger.info('ignoring harmless preprocess exit code %d', exit_code)
         job.transexitcode = 0
@@ -70,38 +78,52 @@ def interpret(job):
 
     # interpret the exit info from the payload
     try:
-        interpret_payload_exit_info(job)
+        interpret_payload_exit_info(job, stdout, stderr)
     except Exception as exc:
         logger.warning('exception caught while interpreting payload exit info: %s', exc)
 
     return exit_code
 
 
-def interpret_payload_exit_info(job):
+def get_payload_log_paths(job):
+    """
+    Return the full paths to the payload stdout and stderr.
+
+    :param job: job object.
+    :return: payload stdout path (string), payload stderr path (string).
+    """
+
+    return os.path.join(job.workdir, config.Payload.payloadstdout), os.path.join(job.workdir, config.Payload.payloadstderr)
+
+
+def interpret_payload_exit_info(job, stdout, stderr):
     """
     Interpret the exit info from the payload
 
     :param job: job object.
+    :param stdout: path to payload stdout (string).
+    :param stderr: path to payload stderr (string).
     :return:
     """
 
     # try to identify out of memory errors in the stderr
-    if is_out_of_memory(job):
+    if is_out_of_memory(job, stdout, stderr):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.PAYLOADOUTOFMEMORY, priority=True)
         return
 
     # look for specific errors in the stdout (tail)
-    if is_installation_error(job):
+    _tail = tail(stdout)
+    if is_installation_error(_tail):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.MISSINGINSTALLATION, priority=True)
         return
 
     # did AtlasSetup fail?
-    if is_atlassetup_error(job):
+    if is_atlassetup_error(_tail):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.SETUPFATAL, priority=True)
         return
 
     # did the payload run out of space?
-    if is_out_of_space(job):
+    if is_out_of_space(stderr):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.NOLOCALSPACE, priority=True)
 
         # double check local space
@@ -119,12 +141,12 @@ def interpret_payload_exit_info(job):
         return
 
     # look for specific errors in the stdout (full)
-    if is_nfssqlite_locking_problem(job):
+    if is_nfssqlite_locking_problem(stdout):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.NFSSQLITE, priority=True)
         return
 
     # is the user tarball missing on the server?
-    if is_user_code_missing(job):
+    if is_user_code_missing(stdout):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.MISSINGUSERCODE, priority=True)
         return
 
@@ -133,45 +155,49 @@ def interpret_payload_exit_info(job):
         job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.UNKNOWNPAYLOADFAILURE, priority=True)
 
 
-def is_out_of_memory(job):
+def is_out_of_memory(job, stdout, stderr):
     """
     Did the payload run out of memory?
 
     :param job: job object.
+    :param stdout: path to payload stdout (string).
+    :param stderr: path to payload stderr (string).
     :return: Boolean. (note: True means the error was found)
     """
 
     out_of_memory = False
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    stderr = os.path.join(job.workdir, config.Payload.payloadstderr)
-
-    files = {stderr: ["FATAL out of memory: taking the application down"], stdout: ["St9bad_alloc", "std::bad_alloc"]}
-    for path in files:
-        if os.path.exists(path):
-            logger.info('looking for out-of-memory errors in %s', os.path.basename(path))
-            if os.path.getsize(path) > 0:
-                matched_lines = grep(files[path], path)
-                if matched_lines:
-                    logger.warning("identified an out of memory error in %s %s:", job.payload, os.path.basename(path))
-                    for line in matched_lines:
-                        logger.info(line)
-                    out_of_memory = True
-        else:
-            logger.warning('file does not exist: %s (cannot look for out-of-memory error in it)')
+    files = ((stderr, ["FATAL out of memory: taking the application down"]), (stdout, ["St9bad_alloc", "std::bad_alloc"]))
+    for path, patterns in files:
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            logger.warning('file does not exist: %s (cannot look for out-of-memory error in it)', path)
+            continue
+        except OSError as exc:
+            logger.warning('cannot stat file %s: %s (cannot look for out-of-memory error in it)', path, exc)
+            continue
+
+        logger.info('looking for out-of-memory errors in %s', os.path.basename(path))
+        if size > 0:
+            matched_lines = scan_for_patterns(path, patterns)
+            if matched_lines:
+                logger.warning("identified an out of memory error in %s %s:", job.payload, os.path.basename(path))
+                for line in matched_lines:
+                    logger.info(line)
+                out_of_memory = True
 
     return out_of_memory
 
 
-def is_user_code_missing(job):
+def is_user_code_missing(stdout):
     """
     Is the user code (tarball) missing on the server?
 
-    :param job: job object.
+    :param stdout: path to payload stdout (string).
     :return: Boolean. (note: True means the error was found)
     """
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
     error_messages = ["ERROR: unable to fetch source tarball from web"]
 
     return scan_file(stdout,
@@ -179,15 +205,14 @@ def is_user_code_missing(job):
                      warning_message="identified an \'%s\' message in %s" % (error_messages[0], os.path.basename(stdout)))
 
 
-def is_out_of_space(job):
+def is_out_of_space(stderr):
     """
     Did the disk run out of space?
 
-    :param job: job object.
+    :param stderr: path to payload stderr (string).
     :return: Boolean. (note: True means the error was found)
     """
 
-    stderr = os.path.join(job.workdir, config.Payload.payloadstderr)
     error_messages = ["No space left on device"]
 
     return scan_file(stderr,
@@ -195,48 +220,111 @@ def is_out_of_space(job):
                      warning_message="identified a \'%s\' message in %s" % (error_messages[0], os.path.basename(stderr)))
 
 
-def is_installation_error(job):
+def is_installation_error(_tail):
     """
     Did the payload fail to run? (Due to faulty/missing installation).
 
-    :param job: job object.
+    :param _tail: tail of the payload stdout (string).
     :return: Boolean. (note: True means the error was found)
     """
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    _tail = tail(stdout)
     res_tmp = _tail[:1024]
     return res_tmp[0:3] == "sh:" and 'setup.sh' in res_tmp and 'No such file or directory' in res_tmp
 
 
-def is_atlassetup_error(job):
+def is_atlassetup_error(_tail):
     """
     Did AtlasSetup fail with a fatal error?
 
-    :param job: job object.
+    :param _tail: tail of the payload stdout (string).
     :return: Boolean. (note: True means the error was found)
     """
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
-    _tail = tail(stdout)
     res_tmp = _tail[:2048]
     return "AtlasSetup(FATAL): Fatal exception" in res_tmp
 
 
-def is_nfssqlite_locking_problem(job):
+def is_nfssqlite_locking_problem(stdout):
     """
     Were there any NFS SQLite locking problems?
 
-    :param job: job object.
+    :param stdout: path to payload stdout (string).
     :return: Boolean. (note: True means the error was found)
     """
 
-    stdout = os.path.join(job.workdir, config.Payload.payloadstdout)
     error_messages = ["prepare 5 database is locked", "Error SQLiteStatement"]
 
-    return scan_file(stdout,
-                     error_messages,
-                     warning_message="identified an NFS/Sqlite locking problem in %s" % os.path.basename(stdout))
+    matched_lines = scan_for_patterns(stdout, error_messages)
+    if matched_lines:
+        logger.warning("identified an NFS/Sqlite locking problem in %s", os.path.basename(stdout))
+        for line in matched_lines:
+            logger.info(line)
+
+    return bool(matched_lines)
+
+
+def scan_for_patterns(path, patterns):
+    """
+    Return the lines in the given file that contain any of the given (literal) patterns.
+    The file is memory mapped and scanned once for all patterns, instead of reading it line by line.
+    For files larger than FULL_SCAN_LIMIT, only the last TAIL_SCAN_SIZE bytes are scanned.
+
+    :param path: path to file (string).
+    :param patterns: literal patterns (list of strings).
+    :return: matched lines (list of strings).
+    """
+
+    try:
+        with open(path, 'rb') as _file:
+            size = os.fstat(_file.fileno()).st_size
+            if size == 0:
+                return []
+            if size <= FULL_SCAN_LIMIT:
+                with mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return get_matching_lines(data, patterns)
+        logger.info('%s is large (%d B) - only scanning the last %d B', os.path.basename(path), size, TAIL_SCAN_SIZE)
+        return get_matching_lines(read_tail_bytes(path, TAIL_SCAN_SIZE), patterns)
+    except (OSError, ValueError) as exc:
+        logger.warning('failed to scan %s: %s', path, exc)
+        return []
+
+
+def get_matching_lines(data, patterns):
+    """
+    Return the lines in the given data that contain any of the given (literal) patterns.
+    The patterns are located with plain find() calls instead of a regular expression. Each pattern is only searched
+    for again once the scan has moved past its previous match.
+
+    :param data: data to be scanned (bytes or mmap).
+    :param patterns: literal patterns (list of strings).
+    :return: matched lines (list of strings).
+    """
+
+    matched_lines = []
+    positions = {}
+    for _pattern in patterns:
+        needle = _pattern.encode()
+        position = data.find(needle)
+        if position != -1:
+            positions[needle] = position
+
+    while positions:
+        position = min(positions.values())
+        start = data.rfind(b'\n', 0, position) + 1
+        end = data.find(b'\n', position)
+        if end == -1:
+            end = len(data)
+        matched_lines.append(data[start:end].decode('utf-8', errors='replace'))
+
+        # continue after the matched line so that each line is only reported once
+        for needle in [needle for needle in positions if positions[needle] <= end]:
+            position = data.find(needle, end + 1)
+            if position == -1:
+                del positions[needle]
+            else:
+                positions[needle] = position
+
+    return matched_lines
 
 
 def extract_special_information(job):
@@ -300,7 +388,7 @@ def find_number_of_events_in_jobreport(job):
     """
 
     try:
-        work_attributes = parse_jobreport_data(job.metadata)
+        work_attributes = get_work_attributes(job)
     except Exception as exc:
         logger.warning('exception caught while parsing job report: %s', exc)
         return
@@ -345,23 +433,28 @@ def process_athena_summary(job):
 
     nev1 = 0
     nev2 = 0
-    file_pattern_list = ['AthSummary*', 'AthenaSummary*']
-
-    file_list = []
-    # loop over all patterns in the list to find all possible summary files
-    for file_pattern in file_pattern_list:
-        # get all the summary files for the current file pattern
-        files = glob(os.path.join(job.workdir, file_pattern))
-        # append all found files to the file list
-        for summary_file in files:
-            file_list.append(summary_file)
-
-    if file_list == [] or file_list == ['']:
+    file_prefixes = ('AthSummary', 'AthenaSummary')  # i.e. AthSummary* and AthenaSummary*
+
+    # find all possible summary files and their modification times in a single directory pass
+    summary_files = []
+    try:
+        with os.scandir(job.workdir) as entries:
+            for entry in entries:
+                if not entry.name.startswith(file_prefixes):
+                    continue
+                try:
+                    summary_files.append((entry.path, entry.stat().st_mtime))
+                except OSError as exc:
+                    logger.warning("could not read modification time of file %s: %s", entry.path, exc)
+    except OSError as exc:
+        logger.warning("could not scan directory %s: %s", job.workdir, exc)
+
+    if not summary_files:
         logger.info("did not find any athena summary files")
     else:
         # find the most recent and the oldest files
-        recent_summary_file, recent_time, oldest_summary_file, oldest_time = \
-            find_most_recent_and_oldest_summary_files(file_list)
+        recent_summary_file, recent_time = max(summary_files, key=lambda item: item[1])
+        oldest_summary_file, oldest_time = min(summary_files, key=lambda item: item[1])
         if oldest_summary_file == recent_summary_file:
             logger.info("summary file %s will be processed for errors and number of events",
                         os.path.basename(oldest_summary_file))
@@ -379,44 +472,6 @@ def process_athena_summary(job):
     return nev1, nev2
 
 
-def find_most_recent_and_oldest_summary_files(file_list):
-    """
-    Find the most recent and the oldest athena summary files.
-    :param file_list: list of athena summary files (list of strings).
-    :return: most recent summary file (string), recent time (int), oldest summary file (string), oldest time (int).
-    """
-
-    oldest_summary_file = ""
-    recent_summary_file = ""
-    oldest_time = 9999999999
-    recent_time = 0
-    if len(file_list) > 1:
-        for summary_file in file_list:
-            # get the modification time
-            try:
-                st_mtime = os.path.getmtime(summary_file)
-            except OSError as exc:  # Python 2/3
-                logger.warning("could not read modification time of file %s: %s", summary_file, exc)
-            else:
-                if st_mtime > recent_time:
-                    recent_time = st_mtime
-                    recent_summary_file = summary_file
-                if st_mtime < oldest_time:
-                    oldest_time = st_mtime
-                    oldest_summary_file = summary_file
-    else:
-        oldest_summary_file = file_list[0]
-        recent_summary_file = oldest_summary_file
-        try:
-            oldest_time = os.path.getmtime(oldest_summary_file)
-        except OSError as exc:  # Python 2/3
-            logger.warning("could not read modification time of file %s: %s", oldest_summary_file, exc)
-        else:
-            recent_time = oldest_time
-
-    return recent_summary_file, recent_time, oldest_summary_file, oldest_time
-
-
 def get_number_of_events_from_summary_file(oldest_summary_file):
     """
     Get the number of events from the oldest summary file.
@@ -428,27 +483,22 @@ def get_number_of_events_from_summary_file(oldest_summary_file):
     nev1 = 0
     nev2 = 0
 
-    _file = open_file(oldest_summary_file, 'r')
-    if _file:
-        lines = _file.readlines()
-        _file.close()
-
-        if lines:
-            for line in lines:
-                if "Events Read:" in line:
-                    try:
-                        nev1 = int(re.match(r'Events Read\: *(\d+)', line).group(1))  # Python 3 (added r)
-                    except ValueError as exc:
-                        logger.warning('failed to convert number of read events to int: %s', exc)
-                if "Events Written:" in line:
-                    try:
-                        nev2 = int(re.match(r'Events Written\: *(\d+)', line).group(1))  # Python 3 (added r)
-                    except ValueError as exc:
-                        logger.warning('failed to convert number of written events to int: %s', exc)
-                if nev1 > 0 and nev2 > 0:
-                    break
-        else:
-            logger.warning('failed to get number of events from empty summary file')
+    try:
+        with open(oldest_summary_file, 'rb') as _file:
+            if os.fstat(_file.fileno()).st_size == 0:
+                logger.warning('failed to get number of events from empty summary file')
+            else:
+                # scan the memory mapped file once for both the read and written event lines
+                with mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    for match in _SUMMARY_EVENTS_RE.finditer(data):
+                        if match.group(1) == b'Read':
+                            nev1 = int(match.group(2))
+                        else:
+                            nev2 = int(match.group(2))
+                        if nev1 > 0 and nev2 > 0:
+                            break
+    except (OSError, ValueError) as exc:
+        logger.warning('failed to read summary file %s: %s', oldest_summary_file, exc)
 
     # Get the errors from the most recent summary file
     # ...
@@ -464,7 +514,7 @@ def find_db_info(job):
     :return:
     """
 
-    work_attributes = parse_jobreport_data(job.metadata)
+    work_attributes = get_work_attributes(job)
     if '__db_time' in work_attributes:
         try:
             job.dbtime = int(work_attributes.get('__db_time'))
@@ -479,25 +529,24 @@ def find_db_info(job):
         logger.info('dbdata (total): %d', job.dbdata)
 
 
-def set_error_nousertarball(job):
+def set_error_nousertarball(job, stdout):
     """
     Set error code for NOUSERTARBALL.
 
     :param job: job object.
+    :param stdout: path to payload stdout (string).
     :return:
     """
 
     # get the tail of the stdout since it will contain the URL of the user log
-    filename = os.path.join(job.workdir, config.Payload.payloadstdout)
-    _tail = tail(filename)
-    _tail += 'http://someurl.se/path'
-    if _tail:
-        # try to extract the tarball url from the tail
-        tarball_url = extract_tarball_url(_tail)
+    _tail = tail(stdout)
+
+    # try to extract the tarball url from the tail
+    tarball_url = extract_tarball_url(_tail)
 
-        job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.NOUSERTARBALL)
-        job.piloterrorcode = errors.NOUSERTARBALL
-        job.piloterrordiag = "User tarball %s cannot be downloaded from PanDA server" % tarball_url
+    job.piloterrorcodes, job.piloterrordiags = errors.add_error_code(errors.NOUSERTARBALL)
+    job.piloterrorcode = errors.NOUSERTARBALL
+    job.piloterrordiag = "User tarball %s cannot be downloaded from PanDA server" % tarball_url
 
 
 def extract_tarball_url(_tail):
@@ -511,10 +560,9 @@ def extract_tarball_url(_tail):
     tarball_url = "(source unknown)"
 
     if "https://" in _tail or "http://" in _tail:
-        pattern = r"(https?\:\/\/.+)"
-        found = re.findall(pattern, _tail)
+        found = _TARBALL_URL_RE.search(_tail)
         if found:
-            tarball_url = found[0]
+            tarball_url = found.group(1)
 
     return tarball_url
 
@@ -531,6 +579,7 @@ def process_metadata_from_xml(job):
     path = os.path.join(job.workdir, config.Payload.metadata)
     if os.path.exists(path):
         job.metadata = read_file(path)
+        job.work_attributes = None
     else:
         if not job.is_analysis() and job.transformation != 'Archive_tf.py':
             diagnostics = 'metadata does not exist: %s' % path
@@ -581,6 +630,7 @@ def process_job_report(job):
             # compulsory field; the payload must produce a job report (see config file for file name), attach it to the
             # job object
             job.metadata = json.load(data_file)
+            job.work_attributes = None
 
             #
             update_job_data(job)
@@ -14,7 +14,7 @@ import logging
 from pilot.api import analytics
 from pilot.util.jobmetrics import get_job_metrics_entry
 from pilot.util.features import MachineFeatures, JobFeatures
-from pilot.util.filehandling import find_last_line
+from pilot.util.filehandling import read_tail_bytes
 from pilot.util.math import float_to_rounded_string
 
 from .cpu import get_core_count
@@ -23,6 +23,11 @@ from .utilities import get_memory_monitor_output_filename
 
 logger = logging.getLogger(__name__)
 
+_EVENT_NUMBER_RE = re.compile(rb'\ done\ processing\ event\ \#(\d+)\,')
+_FITTED_DATA_CACHE = {}  # get_fitted_data() result for the current job, keyed by path, valid while the file is unchanged
+_MACHINE_FEATURES = None  # machine features do not change during the lifetime of the pilot
+_JOB_FEATURES = {}  # job features of the current job, keyed by job id
+
 
 def get_job_metrics_string(job):
     """
@@ -32,35 +37,35 @@ def get_job_metrics_string(job):
     :return: job metrics (string).
     """
 
-    job_metrics = ""
+    job_metrics = []
 
     # report core count (will also set corecount in job object)
     corecount = get_core_count(job)
     logger.debug('job definition core count: %d', corecount)
 
     #if corecount is not None and corecount != "NULL" and corecount != 'null':
-    #    job_metrics += get_job_metrics_entry("coreCount", corecount)
+    #    job_metrics.append(get_job_metrics_entry("coreCount", corecount))
 
     # report number of actual used cores and add it to the list of measured core counts
     if job.actualcorecount:
-        job_metrics += get_job_metrics_entry("actualCoreCount", job.actualcorecount)
+        job_metrics.append(get_job_metrics_entry("actualCoreCount", job.actualcorecount))
 
     # report number of events
     if job.nevents > 0:
-        job_metrics += get_job_metrics_entry("nEvents", job.nevents)
+        job_metrics.append(get_job_metrics_entry("nEvents", job.nevents))
     if job.neventsw > 0:
-        job_metrics += get_job_metrics_entry("nEventsW", job.neventsw)
+        job_metrics.append(get_job_metrics_entry("nEventsW", job.neventsw))
 
     # add metadata from job report
     if job.metadata:
         job.dbtime, job.dbdata = get_db_info(job.metadata)
         job.resimevents = get_resimevents(job.metadata)
     if job.dbtime and job.dbtime != "":
-        job_metrics += get_job_metrics_entry("dbTime", job.dbtime)
+        job_metrics.append(get_job_metrics_entry("dbTime", job.dbtime))
     if job.dbdata and job.dbdata != "":
-        job_metrics += get_job_metrics_entry("dbData", job.dbdata)
+        job_metrics.append(get_job_metrics_entry("dbData", job.dbdata))
     if job.resimevents is not None:
-        job_metrics += get_job_metrics_entry("resimevents", job.resimevents)
+        job_metrics.append(get_job_metrics_entry("resimevents", job.resimevents))
 
     # get the max disk space used by the payload (at the end of a job)
     if job.state == "finished" or job.state == "failed" or job.state == "holding":
@@ -68,53 +73,75 @@ def get_job_metrics_string(job):
         zero = 0
 
         if max_space > zero:
-            job_metrics += get_job_metrics_entry("workDirSize", max_space)
+            job_metrics.append(get_job_metrics_entry("workDirSize", max_space))
         else:
             logger.info("will not add max space = %d B to job metrics", max_space)
 
     # add job and machine feature data if available
-    job_metrics = add_features(job_metrics, corecount, add=['hs06'])
+    job_metrics.append(add_features(corecount, add=['hs06'], jobid=job.jobid))
 
     # get analytics data
-    job_metrics = add_analytics_data(job_metrics, job.workdir, job.state)
+    job_metrics.append(add_analytics_data(job.workdir, job.state))
 
     # extract event number from file and add to job metrics if it exists
-    job_metrics = add_event_number(job_metrics, job.workdir)
+    job_metrics.append(add_event_number(job.workdir))
 
     # add DASK IPs if set
     if job.dask_scheduler_ip and job.jupyter_session_ip:
-        job_metrics += get_job_metrics_entry("schedulerIP", job.dask_scheduler_ip)
-        job_metrics += get_job_metrics_entry("sessionIP", job.jupyter_session_ip)
+        job_metrics.append(get_job_metrics_entry("schedulerIP", job.dask_scheduler_ip))
+        job_metrics.append(get_job_metrics_entry("sessionIP", job.jupyter_session_ip))
 
-    return job_metrics
+    return ''.join(job_metrics)
+
+
+def get_machine_features():
+    """
+    Return the machine features.
+    The features are only read once, since they do not change while the pilot is running.
+
+    :return: machine features (dictionary, a copy that can be modified by the caller).
+    """
+
+    global _MACHINE_FEATURES
+    if _MACHINE_FEATURES is None:
+        _MACHINE_FEATURES = MachineFeatures().get()
+
+    return dict(_MACHINE_FEATURES)
+
+
+def get_job_features(jobid):
+    """
+    Return the job features.
+    The features are only read once per job.
+
+    :param jobid: PanDA job id (string).
+    :return: job features (dictionary, a copy that can be modified by the caller).
+    """
+
+    if jobid not in _JOB_FEATURES:
+        _JOB_FEATURES.clear()
+        _JOB_FEATURES[jobid] = JobFeatures().get()
+
+    return dict(_JOB_FEATURES[jobid])
 
 
-def add_features(job_metrics, corecount, add=[]):
+def add_features(corecount, add=[], jobid=None):
     """
-    Add job and machine feature data to the job metrics if available
+    Return the job metrics entries for the job and machine feature data if available
     If a non-empty add list is specified, only include the corresponding features. If empty/not specified, add all.
 
-    :param job_metrics: job metrics (string).
     :param corecount: core count (int).
     :param add: features to be added (list).
-    :return: updated job metrics (string).
+    :param jobid: PanDA job id (string).
+    :return: job metrics entries (string).
     """
 
-    if job_metrics and not job_metrics.endswith(' '):
-        job_metrics += ' '
+    def add_sub_features(features_dic, add=[]):
+        selected = set(add)
+        return ''.join(f'{key}={value} ' for key, value in features_dic.items() if value and (not selected or key in selected))
 
-    def add_sub_features(job_metrics, features_dic, add=[]):
-        features_str = ''
-        for key in features_dic.keys():
-            if add and key not in add:
-                continue
-            value = features_dic.get(key, None)
-            if value:
-                features_str += f'{key}={value} '
-        return features_str
-
-    machinefeatures = MachineFeatures().get()
-    jobfeatures = JobFeatures().get()
+    machinefeatures = get_machine_features()
+    jobfeatures = get_job_features(jobid)
     # correct hs06 for corecount: hs06*perf_scale/total_cpu*corecount
     hs06 = machinefeatures.get('hs06', 0)
     total_cpu = machinefeatures.get('total_cpu', 0)
@@ -127,30 +154,38 @@ def add_features(job_metrics, corecount, add=[]):
         except (TypeError, ValueError) as exc:
             logger.warning(f'cannot process hs06 machine feature: {exc} (hs06={hs06}, total_cpu={total_cpu}, corecount={corecount})')
     features_list = [machinefeatures, jobfeatures]
-    for feature_item in features_list:
-        features_str = add_sub_features(job_metrics, feature_item, add=add)
-        if features_str:
-            job_metrics += features_str
 
-    return job_metrics
+    return ''.join(add_sub_features(feature_item, add=add) for feature_item in features_list)
 
 
-def add_analytics_data(job_metrics, workdir, state):
+def add_analytics_data(workdir, state):
     """
-    Add the memory leak+chi2 analytics data to the job metrics.
+    Return the job metrics entries for the memory leak+chi2 analytics data.
 
-    :param job_metrics: job metrics (string).
     :param workdir: work directory (string).
     :param state: job state (string).
-    :return: updated job metrics (string).
+    :return: job metrics entries (string).
     """
 
+    job_metrics = ""
+
     path = os.path.join(workdir, get_memory_monitor_output_filename())
-    if os.path.exists(path):
-        client = analytics.Analytics()
+    try:
+        _stat = os.stat(path)
+    except OSError:
+        pass
+    else:
         # do not include tails on final update
         tails = False if (state == "finished" or state == "failed" or state == "holding") else True
-        data = client.get_fitted_data(path, tails=tails)
+
+        # only redo the fit if the memory monitor output has changed since the last call
+        key = (_stat.st_mtime_ns, _stat.st_size, tails)
+        cached_key, data = _FITTED_DATA_CACHE.get(path, (None, None))
+        if cached_key != key:
+            client = analytics.Analytics()
+            data = client.get_fitted_data(path, tails=tails)
+            _FITTED_DATA_CACHE.clear()
+            _FITTED_DATA_CACHE[path] = (key, data)
         slope = data.get("slope", "")
         chi2 = data.get("chi2", "")
         if slope != "":
@@ -161,20 +196,21 @@ def add_analytics_data(job_metrics, workdir, state):
     return job_metrics
 
 
-def add_event_number(job_metrics, workdir):
+def add_event_number(workdir):
     """
-    Extract event number from file and add to job metrics if it exists
+    Extract event number from file and return it as a job metrics entry if it exists
 
-    :param job_metrics: job metrics (string).
     :param workdir: work directory (string).
-    :return: updated job metrics (string).
+    :return: job metrics entry (string).
     """
 
+    job_metrics = ""
+
     path = os.path.join(workdir, 'eventLoopHeartBeat.txt')
     if os.path.exists(path):
-        last_line = find_last_line(path)
+        last_line = get_last_line(path)
         if last_line:
-            event_number = get_number_in_string(last_line)
+            event_number = get_number_in_string(last_line, pattern=_EVENT_NUMBER_RE)
             if event_number:
                 job_metrics += get_job_metrics_entry("eventnumber", event_number)
     else:
@@ -183,6 +219,25 @@ def add_event_number(job_metrics, workdir):
     return job_metrics
 
 
+def get_last_line(path, window=4096):
+    """
+    Return the last non-empty line of the given file.
+    Only the last window bytes are read, so the cost does not grow with the file (which is only ever appended to).
+
+    :param path: full path to file (string).
+    :param window: number of bytes to read from the end of the file (int).
+    :return: last line (bytes).
+    """
+
+    try:
+        data = read_tail_bytes(path, window)
+    except OSError as exc:
+        logger.warning('failed to read %s: %s', path, exc)
+        return b''
+
+    return data.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+
+
 def get_job_metrics(job):
     """
     Return a properly formatted job metrics string.
@@ -213,8 +268,7 @@ def get_job_metrics(job):
         logger.warning("job_metrics out of size (%d)", len(job_metrics))
 
         # try to reduce the field size and remove the last entry which might be cut
-        job_metrics = job_metrics[:500]
-        job_metrics = " ".join(job_metrics.split(" ")[:-1])
+        job_metrics = job_metrics[:max(job_metrics.rfind(' ', 0, 500), 0)]
         logger.warning("job_metrics has been reduced to: %s", job_metrics)
 
     return job_metrics
@@ -228,8 +282,8 @@ def get_number_in_string(line, pattern=r'\ done\ processing\ event\ \#(\d+)\,'):
         done processing event #20166959, run #276689 22807 events read so far  <<<===
     This function will return 20166959 as in int.
 
-    :param line: line from a file (string).
-    :param pattern: reg ex pattern (raw string).
+    :param line: line from a file (string, or bytes for a bytes pattern).
+    :param pattern: reg ex pattern (raw string or compiled pattern).
     :return: extracted number (int).
     """
 
@@ -219,6 +219,35 @@ def tail(filename, nlines=10):
     return stdout
 
 
+def read_tail_bytes(filename, nbytes):
+    """
+    Return the last nbytes of a file (or the full content of a smaller file).
+    Only the requested part of the file is read, independently of the file size.
+
+    :param filename: name of file (string).
+    :param nbytes: maximum number of bytes to read (int).
+    :raises OSError: if the file cannot be opened or read.
+    :return: file tail (bytes).
+    """
+
+    chunks = []
+    _fd = os.open(filename, os.O_RDONLY)
+    try:
+        size = os.fstat(_fd).st_size
+        if size > nbytes:
+            os.lseek(_fd, size - nbytes, os.SEEK_SET)
+        while nbytes > 0:
+            chunk = os.read(_fd, nbytes)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            nbytes -= len(chunk)
+    finally:
+        os.close(_fd)
+
+    return b''.join(chunks)
+
+
 def head(filename, count=20):
     """
     Return the first several line from the given file.
@@ -168,6 +168,7 @@ def run(args):
     targets = {'job': job.control, 'payload': payload.control, 'data': data.control, 'monitor': monitor.control}
     threads = [ExcThread(bucket=queue.Queue(), target=target, kwargs={'queues': queues, 'traces': traces, 'args': args},
                          name=name) for name, target in list(targets.items())]
+    traces.pilot['workers'] = {thread.name: thread for thread in threads}  # used by the monitor thread check
 
     logger.info('starting threads')
     [thread.start() for thread in threads]